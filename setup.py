@@ -17,11 +17,12 @@ VERSION = None  # get this from __version__.py
 
 
 # What packages are required for this module to be executed?
-REQUIRED = ["dash", "black", "click", "regex", "pandoc-attributes"]
+REQUIRED = ["dash", "click"]
 
 # What packages are optional?
 EXTRAS = {
-    # "fancy feature": ["django"],
+    # for formatting generated apps with `bdash --format`
+    "format": ["black"],
 }
 
 # get the absolute path to this file
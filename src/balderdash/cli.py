@@ -1,15 +1,52 @@
 """Click command line script for running balderdash"""
 
+import sys
+from importlib.util import find_spec
+
 import click
 
 from .markdown_converter import MarkdownConverter
 
+# the io default of 8 KiB means a lot of small reads on large documents
+READ_BUFFER_SIZE = 1 << 18
+WRITE_BUFFER_SIZE = 1 << 18
+
 
 @click.command()
 @click.argument("path")
 @click.option("--app-path", type=click.Path(), default=".")
-def main(path, app_path):
-    converter = MarkdownConverter(app_path=app_path)
-    with open(path, encoding="utf8") as f:
-        dash_file = converter.convert(f)
-    print(dash_file)
+@click.option(
+    "--format/--no-format",
+    "blacken",
+    default=False,
+    help="Also run the output through black.",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False),
+    help="Write the Dash app to this file instead of stdout.",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of threads used to render blocks.",
+)
+def main(path, app_path, blacken, output, workers):
+    if blacken and find_spec("black") is None:
+        raise click.UsageError(
+            "--format requires black: pip install balderdash[format]"
+        )
+    converter = MarkdownConverter(app_path=app_path, workers=workers)
+    with open(path, encoding="utf8", buffering=READ_BUFFER_SIZE) as f:
+        dash_file = converter.convert(f, blacken=blacken)
+
+    # write the whole module in one go rather than through print
+    data = dash_file.encode("utf8")
+    if output is not None:
+        with open(output, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+            f.write(data)
+    else:
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
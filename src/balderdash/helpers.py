@@ -1,63 +1,140 @@
+import copy
 import os
-import regex
-from pathlib import Path
-from functools import partial
+import re
+from functools import lru_cache, partial
 
 from dash import callback
 from dash.development.base_component import Component
 
 from .exceptions import ImproperlyConfigured
 
+# directory that included app paths are relative to, read once at import
+APP_BASE_PATH = os.getenv("BDASH_APP_PATH", ".")
 
-def component_to_str(component):
-    """Convert a Dash Component into an evalable string"""
-    props_with_values = [c for c in component._prop_names
-                         if getattr(component, c, None) is not None]
-    wc_props_with_values = [
-        c for c in component.__dict__
-        if any(
-            c.startswith(wc_attr)
-            for wc_attr in component._valid_wildcard_attributes
-        )
-    ]
+# the start of an `app = Dash(...)` statement, up to its opening paren
+_APP_DASH_RE = re.compile(r"\bapp\s*=\s*Dash\(")
 
-    all_props_with_values = props_with_values + wc_props_with_values
 
-    def prop_to_str(component, prop):
-        value = getattr(component, prop)
+def prefix_id(prefix, component_id):
+    """Return component_id with prefix prepended. Only string IDs are
+    prefixed, pattern-matching dict IDs are returned unchanged."""
+    if isinstance(component_id, str):
+        return f"{prefix}{component_id}"
+    return component_id
 
+
+def component_to_str(component, prefix=""):
+    """Convert a Dash Component into an evalable string. If prefix is
+    given, component IDs in the output are prefixed as by `prefix_id`,
+    without modifying the components themselves."""
+    return _component_to_str(component, {}, prefix)
+
+
+def _component_to_str(component, memo, prefix):
+    # memo maps id() of components and lists already converted during this
+    # call to their strings, so shared subtrees are only converted once
+    key = id(component)
+    cached = memo.get(key)
+    if cached is not None:
+        return cached
+
+    valid_props = frozenset(component._prop_names)
+    wc_prefixes = tuple(component._valid_wildcard_attributes)
+    props_with_values = []
+    for name, value in component.__dict__.items():
+        if value is None:
+            continue
+        if name in valid_props or name.startswith(wc_prefixes):
+            props_with_values.append((name, value))
+
+    def prop_to_str(value):
         if isinstance(value, Component):
-            return component_to_str(value)
-        
+            return _component_to_str(value, memo, prefix)
+
         if isinstance(value, list):
-            components = ", ".join(component_to_str(c) for c in value)
-            return f"[{components}]"
-        
+            value_key = id(value)
+            cached = memo.get(value_key)
+            if cached is None:
+                components = ", ".join(
+                    [_component_to_str(c, memo, prefix) for c in value]
+                )
+                cached = memo[value_key] = f"[{components}]"
+            return cached
+
         return repr(value)
-    props_string = ", ".join(f"{prop}={prop_to_str(component, prop)}"
-                             for prop in props_with_values)
-    return f"{component._type}({props_string})"
+
+    def prop_to_kwarg(prop, value):
+        if prop == "id" and prefix:
+            value = prefix_id(prefix, value)
+        if prop.isidentifier():
+            return f"{prop}={prop_to_str(value)}"
+        # wildcard props like `data-*` aren't valid keyword names
+        return f"**{{{prop!r}: {prop_to_str(value)}}}"
+
+    props_string = ", ".join(
+        [prop_to_kwarg(prop, value) for prop, value in props_with_values]
+    )
+    result = memo[key] = f"{component._type}({props_string})"
+    return result
+
+
+def strip_dash_constructor(content):
+    """Remove `app = Dash(...)` statements from content. The arguments
+    can contain nested parens, so the closing paren is found by counting
+    rather than with a (recursive) regex."""
+    pieces = []
+    pos = 0
+    while True:
+        match = _APP_DASH_RE.search(content, pos)
+        if match is None:
+            break
+        depth = 1
+        end = match.end()
+        while end < len(content) and depth:
+            if content[end] == "(":
+                depth += 1
+            elif content[end] == ")":
+                depth -= 1
+            end += 1
+        if depth:
+            # unbalanced parens, leave the rest untouched
+            break
+        pieces.append(content[pos : match.start()])
+        pos = end
+    pieces.append(content[pos:])
+    return "".join(pieces)
 
 
 def preprocess_dash_app(content):
     # strip `app = Dash()``
-    content = regex.sub("app?\s=?\sDash(\((?>[^)(]+|(?1))*+\))", "", content)
-    # strip `app = Dash()``
-    content = regex.sub("app\\.layout", "layout", content)
-    # replace `@callback` with `@bdash_callback`
-    content = regex.sub("@callback|@app\\.callback", "@prefixed_callback", content)
+    content = strip_dash_constructor(content)
+    # replace `app.layout` with `layout`
+    content = content.replace("app.layout", "layout")
+    # replace `@callback` with `@prefixed_callback`
+    content = content.replace("@app.callback", "@prefixed_callback")
+    content = content.replace("@callback", "@prefixed_callback")
     return content
 
 
-def load_dash_app(path, encoding="utf8"):
-    #breakpoint()
-    path = Path(os.getenv("BDASH_APP_PATH", '.')) / Path(path)
+def load_dash_app(path, encoding="utf8", base_path=None):
+    if base_path is None:
+        base_path = APP_BASE_PATH
+    path = os.path.abspath(os.path.join(base_path, path))
+    # the mtime is part of the cache key so edited apps are reloaded
+    layout = _load_layout(path, os.stat(path).st_mtime_ns, encoding)
+    # hand out a copy so callers can't modify the cached layout
+    return copy.deepcopy(layout)
+
+
+@lru_cache(maxsize=128)
+def _load_layout(path, mtime_ns, encoding):
     with open(path, encoding=encoding) as f:
         content = f.read()
-    prefix = f"{path.stem}_"
     content = preprocess_dash_app(content)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    prefix = f"{stem}_"
     scope = {"prefixed_callback": partial(bdash_callback, prefix)}
-    exec(content, scope)
+    exec(compile(content, path, "exec"), scope)
 
     not_configured = ImproperlyConfigured(
         "Your included Dash app must define either an `app` "
@@ -76,15 +153,30 @@ def load_dash_app(path, encoding="utf8"):
 
     if layout is None:
         raise not_configured
-    for component in layout._traverse():
-        if hasattr(component, "id"):
-            component.id = f"{prefix}{component.id}"
+    prefix_ids(layout, prefix)
     return layout
 
 
+def prefix_ids(layout, prefix):
+    """Prefix the ID of every component in layout with `prefix_id`. Walks the
+    tree with an explicit stack rather than the recursive
+    `Component._traverse` generator."""
+    stack = [layout]
+    while stack:
+        component = stack.pop()
+        component_id = getattr(component, "id", None)
+        if component_id is not None:
+            component.id = prefix_id(prefix, component_id)
+        children = getattr(component, "children", None)
+        if isinstance(children, Component):
+            stack.append(children)
+        elif isinstance(children, (list, tuple)):
+            stack.extend(c for c in children if isinstance(c, Component))
+
+
 def bdash_callback(prefix, *args, **kwargs):
     for component in args:
-        component.component_id = f"{prefix}{component.component_id}"
+        component.component_id = prefix_id(prefix, component.component_id)
     def wrapper(func):
         return callback(*args, **kwargs)(func)
     return wrapper
@@ -26,12 +26,48 @@ The MarkdownReader class is adapted from Aaron O'Leary's notedown package:
 https://github.com/aaren/notedown/blob/master/notedown/notedown.py
 """
 
+import os
 import re
-from black import format_str, FileMode
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from textwrap import dedent
 
-from pandocattributes import PandocAttributes
+
+def parse_attributes(attributes):
+    """Parse a Pandoc style attribute string, eg `#id .class key=value`.
+    Values may be wrapped in single or double quotes to include spaces.
+    Returns a tuple of (id, classes, kvs).
+    """
+    identifier = ""
+    classes = []
+    kvs = {}
+    i = 0
+    end = len(attributes)
+    while i < end:
+        if attributes[i].isspace():
+            i += 1
+            continue
+
+        # consume one token, skipping over any quoted sections
+        start = i
+        while i < end and not attributes[i].isspace():
+            if attributes[i] in "\"'":
+                close = attributes.find(attributes[i], i + 1)
+                i = end if close == -1 else close + 1
+            else:
+                i += 1
+        token = attributes[start:i]
+
+        if token.startswith("#"):
+            identifier = token[1:]
+        elif token.startswith("."):
+            classes.append(token[1:])
+        elif "=" in token:
+            key, value = token.split("=", 1)
+            if len(value) > 1 and value[0] == value[-1] and value[0] in "\"'":
+                value = value[1:-1]
+            kvs[key] = value
+    return identifier, classes, kvs
 
 
 class MarkdownConverter:
@@ -67,12 +103,18 @@ class MarkdownConverter:
     (?P=fence)$\n)          # up until the same fence that we started with
     """
 
+    # compiled once and shared by every instance using the default regex
+    _DEFAULT_CODE_PATTERN = re.compile(code_regex, re_flags)
+
     # classes that will be applied to all Markdown components
     markdown_classes = ["dash-markdown"]
 
     # classes that will be applied to all dash layout components
     dash_layout_classes = ["dash-layout"]
 
+    # maximum line length of generated code, black's default
+    line_length = 88
+
     def __init__(
         self,
         code_regex=None,
@@ -80,14 +122,18 @@ class MarkdownConverter:
         dash_layout_classes=None,
         app_path=".",
         indent="    ",
+        workers=1,
     ):
         """
         code_regex - Custom regex for defining code blocks
+        workers    - number of threads used to render blocks, where 1
+                     renders them in order on the calling thread
         precode    - string, lines of code to put at the start of the
                      document, e.g.
                      '%matplotlib inline\nimport numpy as np'
         """
         self.indent = indent
+        self.workers = workers
         self.app_path = Path(app_path)
 
         if code_regex is not None:
@@ -97,7 +143,16 @@ class MarkdownConverter:
         if dash_layout_classes is not None:
             self.dash_layout_classes = dash_layout_classes
 
-        self.code_pattern = re.compile(self.code_regex, self.re_flags)
+        pattern = self._DEFAULT_CODE_PATTERN
+        if code_regex is not None or pattern.pattern != self.code_regex:
+            # custom regex, either passed in or set on a subclass
+            pattern = re.compile(self.code_regex, self.re_flags)
+        self.code_pattern = pattern
+
+    @classmethod
+    def clear_cache(cls):
+        """Recompile the shared default code block pattern."""
+        cls._DEFAULT_CODE_PATTERN = re.compile(cls.code_regex, cls.re_flags)
 
     def new_code_block(self, **kwargs):
         """Create a new code block."""
@@ -123,57 +178,141 @@ class MarkdownConverter:
         return content.strip()
 
     @staticmethod
-    def make_markdown_component(content, component_id=None, classes=None):
+    def string_literal(value):
+        """Return value as a Python string literal, using double quotes
+        unless that needs more escapes than single quotes, as black does."""
+        literal = repr(value)
+        if literal.startswith("'") and value.count('"') <= value.count("'"):
+            body = literal[1:-1].replace("\\'", "'").replace('"', '\\"')
+            literal = f'"{body}"'
+        return literal
+
+    def markdown_literal(self, content):
+        """Return content as a Python string literal, using a triple-quoted
+        string where that can be done safely so the output stays readable.
+        """
+        if '"""' in content or "\\" in content or content.endswith('"'):
+            return self.string_literal(content)
+        return f'"""\n{content}"""'
+
+    def format_call(self, name, kwargs, depth=2):
+        """Format a call as black would. kwargs maps argument names to
+        either code strings or nested calls, given as (name, args) tuples
+        where args is a list of (name, value) pairs and name is None for
+        positional arguments. depth is the indent level the call starts
+        at, by default that of an item in the page layout, which is
+        followed by a trailing comma."""
+        call = (name, list(kwargs.items()))
+        lines = self._split_call("", call, depth, ",")
+        lines[0] = lines[0][len(self.indent * depth) :]
+        lines[-1] = lines[-1][:-1]
+        return "\n".join(lines)
+
+    def _flatten(self, value):
+        """Return a code string or nested call as a single string."""
+        if isinstance(value, str):
+            return value
+        name, args = value
+        return f"{name}({self._flatten_args(args)})"
+
+    def _flatten_args(self, args):
+        return ", ".join(
+            [
+                self._flatten(value) if key is None else f"{key}={self._flatten(value)}"
+                for key, value in args
+            ]
+        )
+
+    def _fits(self, line):
+        return "\n" not in line and len(line) <= self.line_length
+
+    def _split_call(self, prefix, value, depth, suffix):
+        """Return the lines of prefix + value + suffix at depth, splitting
+        value the way black does if it doesn't fit on one line: first with
+        all the arguments on one line inside the brackets, then with one
+        argument per line and a trailing comma."""
+        indent = self.indent * depth
+        line = f"{indent}{prefix}{self._flatten(value)}{suffix}"
+        if isinstance(value, str) or self._fits(line):
+            return [line]
+
+        name, args = value
+        head = f"{indent}{prefix}{name}("
+        tail = f"{indent}){suffix}"
+        arg_indent = self.indent * (depth + 1)
+        body = f"{arg_indent}{self._flatten_args(args)}"
+        # a lone positional code string can't be split any further
+        lone_arg = len(args) == 1 and args[0][0] is None and isinstance(args[0][1], str)
+        if lone_arg or self._fits(body):
+            return [head, body, tail]
+
+        lines = [head]
+        for key, arg in args:
+            arg_prefix = "" if key is None else f"{key}="
+            lines.extend(self._split_call(arg_prefix, arg, depth + 1, ","))
+        lines.append(tail)
+        return lines
+
+    def make_markdown_component(self, content, component_id=None, classes=None):
         kwargs = {}
         if content:
-            kwargs["children"] = f'"""\n{content}"""'
+            kwargs["children"] = self.markdown_literal(content)
         if component_id:
-            kwargs["id"] = component_id
-        if classes:
-            all_classes = self.dash_layout_classes + classes if classes else []
-            kwargs["className"] = f"{' '.join(all_classes)}" if all_classes else None
-        kwargs_str = ", ".join(f"{name}={value}" for name, value in kwargs.items())
-        return f"dcc.Markdown({kwargs_str})"
-
-    @staticmethod
-    def make_dash_component(path, component_id=None, classes=None):
-        kwargs = {"children": f"load_dash_app('{path}')"}
+            kwargs["id"] = self.string_literal(component_id)
+        all_classes = self.markdown_classes + (classes or [])
+        if all_classes:
+            kwargs["className"] = self.string_literal(" ".join(all_classes))
+        return self.format_call("dcc.Markdown", kwargs)
+
+    def make_dash_component(self, path, component_id=None, classes=None):
+        path = self.string_literal(os.fspath(path))
+        kwargs = {"children": ("load_dash_app", [(None, path)])}
         if component_id:
-            kwargs["id"] = component_id
-        if classes:
-            all_classes = self.dash_layout_classes + classes if classes else []
-            kwargs["className"] = f"{' '.join(all_classes)}" if all_classes else None
-        kwargs_str = ", ".join(f"{name}={value}" for name, value in kwargs.items())
-        return f"html.Div({kwargs_str})"
+            kwargs["id"] = self.string_literal(component_id)
+        all_classes = self.dash_layout_classes + (classes or [])
+        if all_classes:
+            kwargs["className"] = self.string_literal(" ".join(all_classes))
+        return self.format_call("html.Div", kwargs)
 
     def blocks_to_components(self, blocks):
         """Convert blocks into Dash components"""
-        for block in blocks:
-            if block["type"] == self.markdown:
-                content = self.preprocess_markdown(block["content"])
-                yield self.make_markdown_component(content)
-            else:
-                # attrs.id       --> the ID
-                # attrs.classes  --> list of classed
-                # attrs.kvs      --> OrderedDict of key, val pairs
-                attrs = PandocAttributes(block["attributes"], "markdown")
-                if "dash" not in attrs.classes:
-                    # Currently ignore code blocks without a `dash` class
-                    continue
-
-                if "app" in attrs.kvs:
-                    # assume this is a file path.
-                    # TODO: also support python imports with optional attribute:
-                    # eg app.foo:layout
-                    path = self.app_path / attrs["app"]
-                else:
-                    # TODO: support copying inline apps into new dir
-                    continue
-                component_id = attrs.id if attrs.id != "" else None
-                classes = [c for c in attrs.classes if c not in ("dash", "app")]
-                yield self.make_dash_component(
-                    path, component_id=component_id, classes=classes
-                )
+        if self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                components = list(executor.map(self.block_to_component, blocks))
+        else:
+            components = map(self.block_to_component, blocks)
+        for component in components:
+            if component is not None:
+                yield component
+
+    def block_to_component(self, block):
+        """Convert a block into a Dash component, or None if the block
+        should not be included in the layout."""
+        if block["type"] == self.markdown:
+            content = self.preprocess_markdown(block["content"])
+            return self.make_markdown_component(content)
+
+        # attr_id  --> the ID
+        # classes  --> list of classes
+        # kvs      --> dict of key, val pairs
+        attr_id, classes, kvs = parse_attributes(block["attributes"])
+        if "dash" not in classes:
+            # Currently ignore code blocks without a `dash` class
+            return None
+
+        if "app" in kvs:
+            # assume this is a file path.
+            # TODO: also support python imports with optional attribute:
+            # eg app.foo:layout
+            path = os.path.normpath(os.path.join(self.app_path, kvs["app"]))
+        else:
+            # TODO: support copying inline apps into new dir
+            return None
+        component_id = attr_id if attr_id != "" else None
+        classes = [c for c in classes if c not in ("dash", "app")]
+        return self.make_dash_component(
+            path, component_id=component_id, classes=classes
+        )
 
     def parse_blocks(self, text):
         """Extract the code and non-code blocks from given markdown text.
@@ -185,62 +324,122 @@ class MarkdownConverter:
         We should switch to an external markdown library if this
         gets much more complicated!
         """
-        code_matches = [m for m in self.code_pattern.finditer(text)]
-
-        # determine where the limits of the non code bits are
-        # based on the code block edges
-        text_starts = [0] + [m.end() for m in code_matches]
-        text_stops = [m.start() for m in code_matches] + [len(text)]
-        text_limits = list(zip(text_starts, text_stops))
-
-        # list of the groups from the code blocks
-        code_blocks = [self.new_code_block(**m.groupdict()) for m in code_matches]
-
-        text_blocks = [self.new_text_block(content=text[i:j]) for i, j in text_limits]
-
-        # create a list of the right length
-        all_blocks = list(range(len(text_blocks) + len(code_blocks)))
-
-        # NOTE: the behaviour here is a bit fragile in that we
-        # assume that cells must alternate between code and
-        # markdown. This isn't the case, as we could have
-        # consecutive code cells, and we get around this by
-        # stripping out empty cells. i.e. two consecutive code cells
-        # have an empty markdown cell between them which is stripped
-        # out because it is empty.
-
-        # cells must alternate in order
-        all_blocks[::2] = text_blocks
-        all_blocks[1::2] = code_blocks
-
-        # remove possible empty Markdown cells
-        all_blocks = [
-            b
-            for b in all_blocks
-            if not (b["type"] == self.markdown and not b["content"])
-        ]
-        return all_blocks
+        if self.code_regex != MarkdownConverter.code_regex:
+            return self.parse_blocks_regex(text)
+        return self.parse_lines(text.splitlines(keepends=True))
 
-    def to_dash(self, string, blacken=True, **kwargs):
-        blocks = self.parse_blocks(string)
-        components = self.blocks_to_components(blocks)
-        layout = f",\n{self.indent}".join(c for c in components)
+    def parse_lines(self, lines):
+        """Extract blocks from an iterable of lines, such as an open file,
+        in a single pass. Lines must keep their line endings.
+        """
+        blocks = []
+        text_lines = []
+        code_lines = None
+        attributes = None
+        for line in lines:
+            if code_lines is None:
+                attributes = self.parse_fence(line)
+                if attributes is None:
+                    text_lines.append(line)
+                else:
+                    code_lines = [line]
+                continue
+
+            code_lines.append(line)
+            if line.rstrip("\r\n") != "```":
+                continue
+
+            self._flush_text(blocks, text_lines)
+            text_lines = []
+            content = "".join(code_lines[1:-1])
+            if content.endswith("\n"):
+                content = content[:-1]
+            blocks.append(
+                self.new_code_block(
+                    raw="".join(code_lines),
+                    fence="```",
+                    attributes=attributes,
+                    content=content,
+                )
+            )
+            code_lines = None
 
-        dash_app = f"""
-from dash import dcc, html, register_page
+        if code_lines is not None:
+            # an unclosed fence is just text
+            text_lines.extend(code_lines)
+        self._flush_text(blocks, text_lines)
+        return blocks
 
-from balderdash import load_dash_app
+    def _flush_text(self, blocks, text_lines):
+        """Add text_lines to blocks as a Markdown block, unless blank."""
+        content = "".join(text_lines)
+        if content.strip():
+            blocks.append(self.new_text_block(content=content))
 
-register_page(__name__)
+    @staticmethod
+    def parse_fence(line):
+        """Return the attributes of an opening code fence line, or None
+        if the line doesn't open a code block."""
+        if not line.startswith("```"):
+            return None
+        rest = line[3:].lstrip(" \t").rstrip()
+        if rest.startswith("{") and rest.endswith("}"):
+            return rest[1:-1]
+        return None
+
+    def parse_blocks_regex(self, text):
+        """Extract blocks using `code_pattern`. Used in place of the line
+        scanner in `parse_blocks` when a custom `code_regex` is set.
+        """
+        blocks = []
+        prev_end = 0
+        for match in self.code_pattern.finditer(text):
+            # consecutive code blocks have only whitespace between them,
+            # which is not worth keeping as a Markdown block
+            content = text[prev_end : match.start()]
+            if content.strip():
+                blocks.append(self.new_text_block(content=content))
+            blocks.append(self.new_code_block(**match.groupdict()))
+            prev_end = match.end()
+
+        content = text[prev_end:]
+        if content.strip():
+            blocks.append(self.new_text_block(content=content))
+        return blocks
+
+    def to_dash(self, string, blacken=False, **kwargs):
+        blocks = self.parse_blocks(string)
+        return self.blocks_to_dash(blocks, blacken=blacken, **kwargs)
+
+    def blocks_to_dash(self, blocks, blacken=False, **kwargs):
+        """Render parsed blocks as a Dash page module. The module is
+        formatted as it's built, so running black over it is optional."""
+        components = list(self.blocks_to_components(blocks))
+        lines = [
+            "from dash import dcc, html, register_page",
+            "",
+            "from balderdash import load_dash_app",
+            "",
+            "register_page(__name__)",
+            "",
+        ]
+        if components:
+            item_indent = self.indent * 2
+            lines.append("layout = html.Div(")
+            lines.append(self.indent + "[")
+            lines.extend(f"{item_indent}{c}," for c in components)
+            lines.append(self.indent + "]")
+            lines.append(")")
+        else:
+            lines.append("layout = html.Div([])")
+        lines.append("")
+        dash_app = "\n".join(lines)
 
-layout = html.Div(
-    [
-        {layout}
-    ]
-)
-"""
         if blacken:
-            dash_app = format_str(dash_app, mode=FileMode()) 
+            # black is slow to import, so only pay for it when it's used
+            from black import format_str, FileMode
+
+            dash_app = format_str(dash_app, mode=FileMode())
         return dash_app
 
     def converts(self, string, **kwargs):
@@ -248,4 +447,8 @@ layout = html.Div(
         return self.to_dash(string, **kwargs)
 
     def convert(self, fp, **kwargs):
-        return self.to_dash(fp.read(), **kwargs)
+        """Read file object fp to Dash file format."""
+        if self.code_regex != MarkdownConverter.code_regex:
+            return self.to_dash(fp.read(), **kwargs)
+        # parse the file as it's read rather than reading it all up front
+        return self.blocks_to_dash(self.parse_lines(fp), **kwargs)